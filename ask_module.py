@@ -3,23 +3,120 @@
 """
 
 import os
+import re
+import html
+import time
+import asyncio
 import logging
-from datetime import datetime
-from typing import Dict, Any
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
 
-from aiogram import Bot
+from aiogram import BaseMiddleware, Bot, F, Router
 from aiogram.types import (
     Message, 
     CallbackQuery, 
     InlineKeyboardMarkup, 
-    InlineKeyboardButton
+    InlineKeyboardButton,
+    MessageEntity
 )
+from aiogram.dispatcher.flags import get_flag
 from aiogram.filters import Command
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from request_module import NotificationManager, now_str
 
 logger = logging.getLogger(__name__)
 
+# Клавиатура подтверждения не меняется, поэтому создается один раз
+_ASK_CONFIRM_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(text="✅ Отправить", callback_data="ask_confirm"),
+        InlineKeyboardButton(text="❌ Отмена", callback_data="ask_cancel")
+    ]
+])
+
+class _SendLimiter:
+    """Ограничивает число одновременных отправок и их частоту в секунду"""
+    
+    def __init__(self, max_at_once: int, max_per_second: float):
+        self._semaphore = asyncio.Semaphore(max_at_once)
+        self._interval = 1 / max_per_second
+        self._next_slot = 0.0
+    
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        # Резервируем ближайший свободный слот и ждем его наступления
+        now = time.monotonic()
+        delay = self._next_slot - now
+        self._next_slot = max(now, self._next_slot) + self._interval
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except BaseException:
+                # При отмене во время ожидания __aexit__ не вызовется
+                self._semaphore.release()
+                raise
+    
+    async def __aexit__(self, *exc_info):
+        self._semaphore.release()
+
+
+def _utf16_len(text: str) -> int:
+    """Длина строки в UTF-16 единицах, в которых Telegram считает offset/length"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+# Подтверждения пользователю отправляются с готовой разметкой, без parse_mode
+_ACK_PREFIX = "✅ "
+_ACK_TITLE = "Ваш вопрос отправлен Дмитрию!"
+_ACK_ENTITIES = [
+    MessageEntity(type="bold", offset=_utf16_len(_ACK_PREFIX), length=_utf16_len(_ACK_TITLE))
+]
+_ACK_TEXT = (
+    f"{_ACK_PREFIX}{_ACK_TITLE}\n\n"
+    "Я уведомил его о вашем сообщении. Обычно он отвечает в течение 24 часов.\n\n"
+    "Спасибо за обращение! ✨"
+)
+_QUICK_ACK_TEXT = (
+    f"{_ACK_PREFIX}{_ACK_TITLE}\n\n"
+    "Я уведомил его о вашем сообщении. Он ответит вам при первой возможности."
+)
+
+
+# Общий лимит на отправку сообщений владельцу (Telegram: ~30 сообщений/сек)
+_owner_send_limiter = _SendLimiter(max_at_once=25, max_per_second=25)
+
+# Быстрый вопрос: "вопрос: текст" в любом регистре, группа 1 — сам вопрос
+_QUICK_RE = re.compile(r"^\s*вопрос\s*:\s*(.*?)\s*$", re.IGNORECASE | re.DOTALL)
+
+# Шаблон сообщения владельцу, общий для /ask и быстрой отправки
+_OWNER_MSG_TMPL = (
+    "❓ <b>{header}</b>\n\n"
+    "👤 <b>Пользователь:</b>\n"
+    "ID: {uid}\n"
+    "Имя: {first}\n"
+    "Фамилия: {last}\n"
+    "Username: @{username}\n\n"
+    "💬 <b>Сообщение:</b>\n{question}\n\n"
+    "⏰ <b>Время:</b> {timestamp}"
+)
+
+
+def _format_owner_message(user, question: str, quick: bool = False) -> str:
+    """Формирует сообщение владельцу с данными пользователя и вопросом (HTML-экранированными)"""
+    header = "ВОПРОС ОТ ПОЛЬЗОВАТЕЛЯ (быстрая отправка)" if quick else "ВОПРОС ОТ ПОЛЬЗОВАТЕЛЯ"
+    return _OWNER_MSG_TMPL.format(
+        header=header,
+        uid=user.id,
+        first=html.escape(user.first_name or 'Не указано'),
+        last=html.escape(user.last_name or 'Не указано'),
+        username=html.escape(user.username or 'Не указан'),
+        question=html.escape(question),
+        timestamp=now_str()
+    )
+
 
 class AskStates(StatesGroup):
     """Состояния для отправки вопроса владельцу"""
@@ -27,6 +124,57 @@ class AskStates(StatesGroup):
     confirming_question = State()
 
 
+class AskThrottle(BaseMiddleware):
+    """Ограничивает частоту вопросов владельцу от одного пользователя
+    
+    Срабатывает только для обработчиков с флагом "ask_throttle", поэтому
+    ввод вопроса и /cancel внутри начатого диалога не блокируются.
+    Пауза отсчитывается, только если обработчик вернул True (вопрос принят):
+    подсказки и отказы ее не запускают.
+    """
+    
+    def __init__(self, cooldown: float = 5.0, max_users: int = 10000):
+        self.cooldown = cooldown
+        self.max_users = max_users
+        # user_id -> время последнего вопроса; самые старые записи в начале
+        self._last: OrderedDict = OrderedDict()
+    
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not get_flag(data, "ask_throttle") or event.from_user is None:
+            return await handler(event, data)
+        
+        uid = event.from_user.id
+        now = time.monotonic()
+        last = self._last.get(uid)
+        if last is not None and now - last < self.cooldown:
+            await event.answer("⏳ Слишком часто, подождите несколько секунд.")
+            return None
+        
+        # Слот занимается до вызова обработчика: апдейты обрабатываются
+        # параллельно, и иначе вся пачка от одного пользователя прошла бы проверку
+        self._last[uid] = now
+        self._last.move_to_end(uid)
+        if len(self._last) > self.max_users:
+            self._last.popitem(last=False)
+        
+        result = None
+        try:
+            result = await handler(event, data)
+            return result
+        finally:
+            if result is not True and self._last.get(uid) == now:
+                # Вопрос не принят: возвращаем прежнее значение
+                if last is None:
+                    del self._last[uid]
+                else:
+                    self._last[uid] = last
+
+
 class AskModule:
     """Модуль для обработки вопросов владельцу"""
     
@@ -39,43 +187,81 @@ class AskModule:
             bot: Bot aiogram
             owner_id: Telegram ID владельца
         """
+        # Состояния /ask в памяти не видны другим процессам бота
+        workers = int(os.getenv("WORKERS", "1"))
+        if workers > 1 and isinstance(dp.fsm.storage, MemoryStorage):
+            raise RuntimeError(
+                "AskModule requires a shared FSM storage (set REDIS_URL) when WORKERS > 1"
+            )
+        
         self.dp = dp
         self.bot = bot
         self.owner_id = owner_id or os.getenv("OWNER_TELEGRAM_ID")
+        # Журнал вопросов и пакетная отправка уведомлений владельцу
+        # Файловый журнал рассчитан на один процесс, при WORKERS > 1 он только в памяти
+        if workers > 1:
+            logger.warning("WORKERS > 1: notifications log is kept in memory only, file logging is disabled")
+        self.notifier = NotificationManager(owner_telegram_id=self.owner_id, persist=workers == 1)
+        self.owner_id_int = self.notifier.owner_id_int
+        # Обработчики кнопок подтверждения по значению callback_data
+        self._cb_handlers = {
+            "ask_confirm": self._do_confirm,
+            "ask_cancel": self._do_cancel,
+        }
         
         # Регистрируем обработчики
         self.register_handlers()
     
     def register_handlers(self):
-        """Регистрирует обработчики команд"""
+        """Регистрирует обработчики команд в отдельном роутере модуля"""
+        self.router = Router(name="ask")
+        # Не чаще одного /ask или быстрого вопроса от пользователя раз в 5 секунд
+        self.router.message.middleware(AskThrottle())
+        
         # Команда /ask
-        self.dp.message.register(self.cmd_ask_owner, Command("ask"))
+        self.router.message.register(
+            self.cmd_ask_owner,
+            Command("ask"),
+            flags={"ask_throttle": True}
+        )
         
         # Обработка вопроса
-        self.dp.message.register(
+        self.router.message.register(
             self.process_ask_question, 
             AskStates.waiting_for_question
         )
         
         # Подтверждение отправки
-        self.dp.callback_query.register(
+        self.router.callback_query.register(
             self.handle_ask_confirmation,
-            AskStates.confirming_question
+            AskStates.confirming_question,
+            F.data.in_(frozenset(self._cb_handlers))
         )
         
         # Быстрая отправка через префикс
-        from aiogram import F
-        self.dp.message.register(
+        self.router.message.register(
             self.handle_quick_ask,
-            F.text.startswith("вопрос:")
+            F.text.regexp(_QUICK_RE).as_("quick_match"),
+            flags={"ask_throttle": True}
         )
         
         # Команда /cancel для этого модуля
-        self.dp.message.register(self.cmd_cancel, Command("cancel"))
+        self.router.message.register(self.cmd_cancel, Command("cancel"))
+        
+        self.dp.include_router(self.router)
+    
+    async def _rate_limited_send(self, text: str):
+        """Отправляет сообщение владельцу с учетом общего лимита"""
+        async with _owner_send_limiter:
+            await self.bot.send_message(
+                chat_id=self.owner_id_int,
+                text=text,
+                parse_mode="HTML"
+            )
     
     async def cmd_ask_owner(self, message: Message, state: FSMContext):
-        """Начало диалога для отправки вопроса владельцу"""
-        if not self.owner_id:
+        """Начало диалога для отправки вопроса владельцу (True, если диалог начат)"""
+        if self.owner_id_int is None:
             await message.answer(
                 "❌ Функция связи с владельцем временно недоступна.\n"
                 "Владелец не указал свои контактные данные."
@@ -89,6 +275,7 @@ class AskModule:
             parse_mode="HTML"
         )
         await state.set_state(AskStates.waiting_for_question)
+        return True
     
     async def process_ask_question(self, message: Message, state: FSMContext):
         """Обработка вопроса пользователя"""
@@ -103,91 +290,93 @@ class AskModule:
         # Сохраняем вопрос
         await state.update_data(question=user_question)
         
-        # Создаем клавиатуру для подтверждения
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text="✅ Отправить", callback_data="ask_confirm"),
-                InlineKeyboardButton(text="❌ Отмена", callback_data="ask_cancel")
-            ]
-        ])
-        
-        # Показываем подтверждение
+        # Показываем подтверждение (длинный вопрос обрезаем до 300 символов)
+        preview = user_question if len(user_question) <= 300 else user_question[:297] + "…"
+        preview = html.escape(preview)
         await message.answer(
             f"<b>Подтвердите отправку:</b>\n\n"
-            f"<i>{user_question[:300]}...</i>\n\n"
+            f"<i>{preview}</i>\n\n"
             f"Отправить этот вопрос Дмитрию?",
             parse_mode="HTML",
-            reply_markup=keyboard
+            reply_markup=_ASK_CONFIRM_KEYBOARD
         )
         await state.set_state(AskStates.confirming_question)
     
     async def handle_ask_confirmation(self, callback: CallbackQuery, state: FSMContext):
         """Обработка подтверждения отправки вопроса"""
-        data = await state.get_data()
-        question = data.get("question", "")
+        # Сразу отвечаем на callback, чтобы у пользователя пропали "часики"
+        await callback.answer()
         
-        if callback.data == "ask_confirm":
-            try:
-                if not self.owner_id:
-                    await callback.message.edit_text(
-                        "❌ Ошибка: ID владельца не указан в настройках."
-                    )
-                    await state.clear()
-                    await callback.answer()
-                    return
-                
-                # Формируем сообщение для владельца
-                user = callback.from_user
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                
-                owner_message = (
-                    f"❓ <b>ВОПРОС ОТ ПОЛЬЗОВАТЕЛЯ</b>\n\n"
-                    f"👤 <b>Пользователь:</b>\n"
-                    f"ID: {user.id}\n"
-                    f"Имя: {user.first_name or 'Не указано'}\n"
-                    f"Фамилия: {user.last_name or 'Не указано'}\n"
-                    f"Username: @{user.username or 'Не указан'}\n\n"
-                    f"💬 <b>Сообщение:</b>\n{question}\n\n"
-                    f"⏰ <b>Время:</b> {timestamp}"
-                )
-                
-                # Отправляем владельцу
-                await self.bot.send_message(
-                    chat_id=int(self.owner_id),
-                    text=owner_message,
-                    parse_mode="HTML"
-                )
-                
-                # Подтверждаем пользователю
-                await callback.message.edit_text(
-                    "✅ <b>Ваш вопрос отправлен Дмитрию!</b>\n\n"
-                    "Я уведомил его о вашем сообщении. Обычно он отвечает в течение 24 часов.\n\n"
-                    "Спасибо за обращение! ✨",
-                    parse_mode="HTML"
-                )
-                
-                # Логируем
-                logger.info(f"Question sent to owner from user {user.id}: {question[:50]}...")
-                
-            except Exception as e:
-                logger.error(f"Error sending question to owner: {type(e).__name__}: {e}")
-                await callback.message.edit_text(
-                    "❌ <b>Произошла ошибка при отправке</b>\n\n"
-                    "Пожалуйста, попробуйте позже или свяжитесь другим способом.",
-                    parse_mode="HTML"
-                )
-        
-        elif callback.data == "ask_cancel":
-            await callback.message.edit_text("❌ Отправка вопроса отменена.")
+        handler = self._cb_handlers.get(callback.data)
+        if handler:
+            await handler(callback, state)
         
         # Очищаем состояние
         await state.clear()
-        await callback.answer()
     
-    async def handle_quick_ask(self, message: Message):
-        """Быстрая отправка вопроса через префикс 'вопрос:'"""
-        # Извлекаем текст вопроса
-        question_text = message.text.replace("вопрос:", "", 1).strip()
+    async def _do_confirm(self, callback: CallbackQuery, state: FSMContext):
+        """Отправка подтвержденного вопроса владельцу"""
+        data = await state.get_data()
+        question = data.get("question", "")
+        
+        if self.owner_id_int is None:
+            await callback.message.edit_text(
+                "❌ Ошибка: ID владельца не указан в настройках."
+            )
+            return
+        
+        # Формируем сообщение для владельца
+        user = callback.from_user
+        owner_message = _format_owner_message(user, question)
+        user_info = {
+            "id": user.id,
+            "username": user.username,
+            "first_name": user.first_name,
+            "last_name": user.last_name
+        }
+        
+        # Отправка владельцу, ответ пользователю и запись в лог независимы:
+        # сбой одной из них не должен отменять остальные
+        send_result, ack_result, _ = await asyncio.gather(
+            self._rate_limited_send(owner_message),
+            self._edit_to_ack(callback.message),
+            self.notifier._log_notification(question, user_info, "user_question"),
+            return_exceptions=True
+        )
+        
+        if isinstance(send_result, BaseException):
+            logger.error(f"Error sending question to owner: {type(send_result).__name__}: {send_result}")
+            await callback.message.edit_text(
+                "❌ <b>Произошла ошибка при отправке</b>\n\n"
+                "Пожалуйста, попробуйте позже или свяжитесь другим способом.",
+                parse_mode="HTML"
+            )
+            return
+        
+        if isinstance(ack_result, BaseException):
+            # Вопрос уже доставлен, не удалось только обновить сообщение пользователя
+            logger.error(f"Error confirming question to user: {type(ack_result).__name__}: {ack_result}")
+        
+        # Логируем
+        logger.info(f"Question sent to owner from user {user.id}: {question[:50]}...")
+    
+    async def _edit_to_ack(self, message: Message):
+        """Меняет сообщение с кнопками на подтверждение отправки"""
+        # edit_text возвращает объект метода aiogram, а не корутину: gather его не примет
+        await message.edit_text(
+            _ACK_TEXT,
+            parse_mode=None,
+            entities=_ACK_ENTITIES
+        )
+    
+    async def _do_cancel(self, callback: CallbackQuery, state: FSMContext):
+        """Отмена отправки вопроса"""
+        await callback.message.edit_text("❌ Отправка вопроса отменена.")
+    
+    async def handle_quick_ask(self, message: Message, quick_match: re.Match):
+        """Быстрая отправка вопроса через префикс 'вопрос:' (True, если вопрос принят)"""
+        # Текст вопроса уже выделен фильтром
+        question_text = quick_match.group(1)
         
         if not question_text:
             await message.answer(
@@ -197,7 +386,7 @@ class AskModule:
             )
             return
         
-        if not self.owner_id:
+        if self.owner_id_int is None:
             await message.answer(
                 "❌ Функция связи с владельцем временно недоступна."
             )
@@ -206,35 +395,21 @@ class AskModule:
         try:
             # Формируем сообщение для владельца
             user = message.from_user
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            owner_message = (
-                f"❓ <b>ВОПРОС ОТ ПОЛЬЗОВАТЕЛЯ (быстрая отправка)</b>\n\n"
-                f"👤 <b>Пользователь:</b>\n"
-                f"ID: {user.id}\n"
-                f"Имя: {user.first_name or 'Не указано'}\n"
-                f"Фамилия: {user.last_name or 'Не указано'}\n"
-                f"Username: @{user.username or 'Не указан'}\n\n"
-                f"💬 <b>Сообщение:</b>\n{question_text}\n\n"
-                f"⏰ <b>Время:</b> {timestamp}"
-            )
+            owner_message = _format_owner_message(user, question_text, quick=True)
             
-            # Отправляем владельцу
-            await self.bot.send_message(
-                chat_id=int(self.owner_id),
-                text=owner_message,
-                parse_mode="HTML"
-            )
+            # Быстрые вопросы уходят владельцу пачками, чтобы не упереться в лимит чата
+            await self.notifier.queue_owner_message(owner_message, self.bot)
             
             # Подтверждаем пользователю
             await message.answer(
-                "✅ <b>Ваш вопрос отправлен Дмитрию!</b>\n\n"
-                "Я уведомил его о вашем сообщении. Он ответит вам при первой возможности.",
-                parse_mode="HTML"
+                _QUICK_ACK_TEXT,
+                parse_mode=None,
+                entities=_ACK_ENTITIES
             )
             
             # Логируем
             logger.info(f"Quick question sent to owner from user {user.id}")
+            return True
             
         except Exception as e:
             logger.error(f"Error sending quick question: {type(e).__name__}: {e}")
@@ -3,45 +3,216 @@
 ##Модуль для отправки уведомлений владельцу бота
 ##"""
 import asyncio
+import html
 import logging
 from datetime import datetime
 from typing import Optional, Dict, Any
 import os
+import time
 from pathlib import Path
 
+import orjson
+
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
+def parse_chat_id(raw: Optional[str]) -> Optional[int]:
+    """
+    Приводит Telegram ID (в том числе отрицательный ID группы) к int
+    
+    Returns:
+        ID или None, если он не задан
+        
+    Raises:
+        ValueError: если ID задан, но не является числом
+    """
+    if not raw:
+        return None
+    try:
+        return int(raw.strip())
+    except ValueError:
+        raise ValueError(f"Invalid owner Telegram ID: {raw!r}") from None
+
+
+# Кэш отформатированного времени: strftime вызывается не чаще раза в секунду
+_last_ts_sec = 0
+_last_ts_str = ""
+
+
+def now_str() -> str:
+    """Возвращает текущее время в формате 'YYYY-MM-DD HH:MM:SS'"""
+    global _last_ts_sec, _last_ts_str
+    sec = int(time.time())
+    if sec != _last_ts_sec:
+        _last_ts_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(sec))
+        _last_ts_sec = sec
+    return _last_ts_str
+
 
 class NotificationManager:
     """Менеджер уведомлений для отправки запросов владельцу"""
     
-    def __init__(self, owner_telegram_id: Optional[str] = None, owner_email: Optional[str] = None):
+    def __init__(
+        self,
+        owner_telegram_id: Optional[str] = None,
+        owner_email: Optional[str] = None,
+        persist: bool = True
+    ):
         """
         Инициализация менеджера уведомлений
         
         Args:
             owner_telegram_id: Telegram ID владельца для отправки сообщений
             owner_email: Email владельца для отправки уведомлений
+            persist: Сохранять ли лог в notifications_log.jsonl. Файл рассчитан
+                на один процесс: при нескольких процессах ID пересекаются,
+                а перезапись файла одним процессом стирает записи других
         """
         self.owner_telegram_id = owner_telegram_id
+        # ID приводится к int один раз; некорректное значение останавливает запуск,
+        # а не всплывает ошибкой на первом вопросе пользователя
+        self.owner_id_int = parse_chat_id(owner_telegram_id)
         self.owner_email = owner_email
-        self.notifications_log_file = Path("notifications_log.json")
-        self._ensure_log_file()
+        self.notifications_log_file = Path("notifications_log.jsonl")
+        self.max_notifications = 100  # Сколько последних уведомлений хранить
+        self.write_batch_delay = 0.1  # Окно накопления записей, сек
+        self.persist = persist
+        if persist:
+            self._ensure_log_file()
+        
+        # Лог целиком живет в памяти, файл обновляется фоновой задачей
+        self._cache: Dict[str, Any] = {
+            "notifications": self._load_notifications() if persist else []
+        }
+        notifications = self._cache["notifications"]
+        self._next_id = notifications[-1]["id"] + 1 if notifications else 1
+        # Индексы поверх кэша: поиск по ID и список ожидающих без полного перебора
+        self._cache_by_id: Dict[int, Dict[str, Any]] = {n["id"]: n for n in notifications}
+        self._pending_ids: set = {n["id"] for n in notifications if n.get("status") == "pending"}
+        self._unsaved: list = []  # Записи, еще не дописанные в файл
+        self._needs_rewrite = False
+        self._appends_since_compact = 0
+        self._write_queue: asyncio.Queue = asyncio.Queue()
+        self._writer_task: Optional[asyncio.Task] = None
+        
+        # Уведомления в Telegram копятся в очереди и уходят владельцу пачками
+        self.batch_max_messages = 10  # Максимум уведомлений в одном сообщении
+        self.batch_max_delay = 0.5  # Сколько ждать попутных уведомлений, сек
+        self._batch_queue: asyncio.Queue = asyncio.Queue()
+        self._batch_task: Optional[asyncio.Task] = None
     
     def _ensure_log_file(self):
         """Создает файл лога уведомлений, если он не существует"""
         if not self.notifications_log_file.exists():
-            initial_data = {
-                "notifications": [],
-                "settings": {
-                    "telegram_enabled": self.owner_telegram_id is not None,
-                    "email_enabled": False,  # Пока не реализовано
-                    "created_at": datetime.now().isoformat()
-                }
-            }
-            import json
-            self.notifications_log_file.write_text(json.dumps(initial_data, ensure_ascii=False, indent=2))
+            self.notifications_log_file.touch()
+    
+    def _load_notifications(self) -> list:
+        """Читает последние уведомления из JSONL файла (одна запись на строку)"""
+        notifications = []
+        try:
+            with self.notifications_log_file.open("rb") as f:
+                for line_no, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    # Битая строка (например, оборванная запись) не должна терять остальные
+                    try:
+                        record = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        logger.error(f"Skipping corrupted line {line_no} in notifications log")
+                        continue
+                    if not isinstance(record, dict) or not isinstance(record.get("id"), int):
+                        logger.error(f"Skipping line {line_no} without notification id in notifications log")
+                        continue
+                    notifications.append(record)
+        except Exception as e:
+            logger.error(f"Failed to load notifications log: {type(e).__name__}")
+        return notifications[-self.max_notifications:]
+    
+    def _write_notifications(self, notifications: list):
+        """Полностью перезаписывает JSONL файл переданными уведомлениями"""
+        tmp_file = self.notifications_log_file.with_suffix(".jsonl.tmp")
+        with tmp_file.open("wb") as f:
+            for notification in notifications:
+                f.write(orjson.dumps(notification) + b"\n")
+        tmp_file.replace(self.notifications_log_file)
+    
+    def _append_notifications(self, notifications: list):
+        """Дописывает уведомления в конец JSONL файла"""
+        data = b"".join(orjson.dumps(n) + b"\n" for n in notifications)
+        with self.notifications_log_file.open("ab+") as f:
+            # Если прошлая запись оборвалась без перевода строки, не склеиваемся с ней
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    data = b"\n" + data
+            f.write(data)
+    
+    def _mark_dirty(self):
+        """Сообщает фоновой задаче, что лог нужно сохранить"""
+        if not self.persist:
+            # Лог только в памяти: сохранять нечего
+            self._unsaved.clear()
+            self._needs_rewrite = False
+            return
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = asyncio.create_task(self._writer_loop())
+        self._write_queue.put_nowait(True)
+    
+    async def _writer_loop(self):
+        """Фоновая задача: пачками сохраняет изменения лога на диск"""
+        while True:
+            await self._write_queue.get()
+            # Даем накопиться соседним изменениям и сохраняем их одной записью
+            await asyncio.sleep(self.write_batch_delay)
+            batch_size = 1
+            while not self._write_queue.empty():
+                self._write_queue.get_nowait()
+                batch_size += 1
+            try:
+                await self._flush()
+            except Exception as e:
+                logger.error(f"Failed to write notifications log: {type(e).__name__}")
+            finally:
+                for _ in range(batch_size):
+                    self._write_queue.task_done()
+    
+    async def _flush(self):
+        """Сохраняет накопленные изменения: дописыванием или перезаписью файла"""
+        unsaved, self._unsaved = self._unsaved, []
+        # Периодически (и после изменения статусов) перезаписываем файл целиком
+        rewrite = (
+            self._needs_rewrite
+            or self._appends_since_compact + len(unsaved) >= self.max_notifications
+        )
+        self._needs_rewrite = False
+        
+        try:
+            if rewrite:
+                snapshot = list(self._cache["notifications"])
+                await asyncio.to_thread(self._write_notifications, snapshot)
+            elif unsaved:
+                await asyncio.to_thread(self._append_notifications, unsaved)
+        except Exception:
+            # Возвращаем изменения, чтобы сохранить их при следующей записи
+            self._unsaved = unsaved + self._unsaved
+            self._needs_rewrite = self._needs_rewrite or rewrite
+            raise
+        
+        if rewrite:
+            self._appends_since_compact = 0
+        else:
+            self._appends_since_compact += len(unsaved)
+    
+    async def flush(self):
+        """Дожидается отправки уведомлений из очереди и сохранения лога (например, перед остановкой)"""
+        await self._batch_queue.join()
+        await self._write_queue.join()
+        # Последняя попытка для изменений, которые не удалось записать ранее
+        if self._unsaved or self._needs_rewrite:
+            try:
+                await self._flush()
+            except Exception as e:
+                logger.error(f"Failed to write notifications log: {type(e).__name__}")
     
     async def send_to_owner(
         self, 
@@ -60,27 +231,29 @@ class NotificationManager:
             notification_type: Тип уведомления (user_question, feedback, etc.)
             
         Returns:
-            Словарь с результатами отправки
+            Словарь с результатами отправки. Сообщения в Telegram уходят
+            пачками из фоновой задачи, поэтому "telegram_queued" означает,
+            что уведомление поставлено в очередь, а не доставлено
         """
         results = {
-            "telegram_sent": False,
+            "telegram_queued": False,
             "email_sent": False,
             "logged": False,
             "errors": []
         }
         
         # Логируем уведомление
-        log_result = self._log_notification(message, user_info, notification_type)
+        log_result = await self._log_notification(message, user_info, notification_type)
         results["logged"] = log_result["success"]
         if not log_result["success"]:
             results["errors"].append(f"Log error: {log_result.get('error')}")
         
         # Отправляем в Telegram, если есть ID владельца и экземпляр бота
-        if self.owner_telegram_id and bot_instance:
+        if self.owner_id_int is not None and bot_instance:
             telegram_result = await self._send_telegram_notification(
                 message, user_info, bot_instance, notification_type
             )
-            results["telegram_sent"] = telegram_result["success"]
+            results["telegram_queued"] = telegram_result["success"]
             if not telegram_result["success"]:
                 results["errors"].append(f"Telegram error: {telegram_result.get('error')}")
         
@@ -98,25 +271,71 @@ class NotificationManager:
         bot_instance,
         notification_type: str
     ) -> Dict[str, Any]:
-        """Отправляет уведомление владельцу в Telegram"""
+        """Ставит уведомление владельцу в очередь на отправку в Telegram"""
         try:
-            # Форматируем сообщение для владельца
+            # Форматируем сообщение сразу, чтобы в нем было время события
             formatted_message = self._format_notification_message(message, user_info, notification_type)
-            
-            # Отправляем сообщение
-            await bot_instance.send_message(
-                chat_id=self.owner_telegram_id,
-                text=formatted_message,
-                parse_mode="HTML"
-            )
-            
-            logger.info(f"Notification sent to owner (Telegram ID: {self.owner_telegram_id})")
+            await self.queue_owner_message(formatted_message, bot_instance)
             return {"success": True}
             
         except Exception as e:
-            logger.error(f"Failed to send Telegram notification: {type(e).__name__}")
+            logger.error(f"Failed to queue Telegram notification: {type(e).__name__}")
             return {"success": False, "error": str(e)}
     
+    async def queue_owner_message(self, text: str, bot_instance):
+        """Ставит готовое HTML-сообщение владельцу в очередь пакетной отправки"""
+        if self._batch_task is None or self._batch_task.done():
+            self._batch_task = asyncio.create_task(self._owner_batch_flusher())
+        await self._batch_queue.put((text, bot_instance))
+    
+    async def _owner_batch_flusher(self):
+        """Фоновая задача: объединяет накопленные уведомления и отправляет их владельцу"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._batch_queue.get()]
+            
+            # Добираем попутные уведомления, пока не наберется пачка или не выйдет время
+            deadline = loop.time() + self.batch_max_delay
+            while len(batch) < self.batch_max_messages:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._batch_queue.get(), timeout=timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                await self._send_batch(batch)
+            finally:
+                for _ in batch:
+                    self._batch_queue.task_done()
+    
+    async def _send_batch(self, batch: list):
+        """Отправляет пачку уведомлений, не превышая лимит длины сообщения Telegram"""
+        bot_instance = batch[-1][1]
+        separator = "\n━━━━━━━━━━\n\n"
+        chunks = []
+        current = ""
+        for formatted_message, _ in batch:
+            if current and len(current) + len(separator) + len(formatted_message) > 4096:
+                chunks.append(current)
+                current = formatted_message
+            else:
+                current = current + separator + formatted_message if current else formatted_message
+        chunks.append(current)
+        
+        for text in chunks:
+            try:
+                await bot_instance.send_message(
+                    chat_id=self.owner_id_int,
+                    text=text,
+                    parse_mode="HTML"
+                )
+                logger.info(f"Notification sent to owner (Telegram ID: {self.owner_id_int})")
+            except Exception as e:
+                logger.error(f"Failed to send Telegram notification: {type(e).__name__}")
+    
     def _format_notification_message(
         self, 
         message: str, 
@@ -124,12 +343,14 @@ class NotificationManager:
         notification_type: str
     ) -> str:
         """Форматирует сообщение для отправки владельцу"""
+        # Все пользовательские данные экранируются: сообщение уходит с parse_mode="HTML"
         user_id = user_info.get('id', 'N/A')
-        username = user_info.get('username', 'N/A')
-        first_name = user_info.get('first_name', 'N/A')
-        last_name = user_info.get('last_name', 'N/A')
+        username = html.escape(str(user_info.get('username', 'N/A')))
+        first_name = html.escape(str(user_info.get('first_name', 'N/A')))
+        last_name = html.escape(str(user_info.get('last_name', 'N/A')))
+        message = html.escape(message)
         
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        timestamp = now_str()
         
         notification_types = {
             "user_question": "❓ ВОПРОС ОТ ПОЛЬЗОВАТЕЛЯ",
@@ -154,42 +375,38 @@ Username: @{username}
 """
         return formatted
     
-    def _log_notification(
+    async def _log_notification(
         self, 
         message: str, 
         user_info: Dict[str, Any],
         notification_type: str
     ) -> Dict[str, Any]:
-        """Логирует уведомление в JSON файл"""
+        """Добавляет уведомление в лог (на диск пишет фоновая задача)"""
         try:
-            import json
-            from datetime import datetime
-            
-            # Читаем существующие данные
-            if self.notifications_log_file.exists():
-                data = json.loads(self.notifications_log_file.read_text())
-            else:
-                data = {"notifications": []}
-            
             # Создаем новую запись
             notification = {
-                "id": len(data["notifications"]) + 1,
+                "id": self._next_id,
                 "timestamp": datetime.now().isoformat(),
                 "type": notification_type,
                 "user_info": user_info,
                 "message": message,
                 "status": "pending"  # pending, reviewed, responded, archived
             }
+            self._next_id += 1
             
             # Добавляем в лог (сохраняем последние 100 уведомлений)
-            data["notifications"].append(notification)
-            if len(data["notifications"]) > 100:
-                data["notifications"] = data["notifications"][-100:]
+            notifications = self._cache["notifications"]
+            notifications.append(notification)
+            self._cache_by_id[notification["id"]] = notification
+            self._pending_ids.add(notification["id"])
+            if len(notifications) > self.max_notifications:
+                for old in notifications[:-self.max_notifications]:
+                    self._cache_by_id.pop(old["id"], None)
+                    self._pending_ids.discard(old["id"])
+                del notifications[:-self.max_notifications]
             
-            # Сохраняем
-            self.notifications_log_file.write_text(
-                json.dumps(data, ensure_ascii=False, indent=2)
-            )
+            self._unsaved.append(notification)
+            self._mark_dirty()
             
             return {"success": True, "notification_id": notification["id"]}
             
@@ -197,38 +414,24 @@ Username: @{username}
             logger.error(f"Failed to log notification: {type(e).__name__}")
             return {"success": False, "error": str(e)}
     
-    def get_pending_notifications(self) -> list:
+    async def get_pending_notifications(self) -> list:
         """Возвращает список ожидающих уведомлений"""
-        try:
-            import json
-            if self.notifications_log_file.exists():
-                data = json.loads(self.notifications_log_file.read_text())
-                return [n for n in data["notifications"] if n.get("status") == "pending"]
-            return []
-        except Exception as e:
-            logger.error(f"Failed to get pending notifications: {type(e).__name__}")
-            return []
+        return [self._cache_by_id[i] for i in sorted(self._pending_ids)]
     
-    def mark_notification_as_reviewed(self, notification_id: int) -> bool:
+    async def mark_notification_as_reviewed(self, notification_id: int) -> bool:
         """Отмечает уведомление как просмотренное"""
-        try:
-            import json
-            if self.notifications_log_file.exists():
-                data = json.loads(self.notifications_log_file.read_text())
-                
-                for notification in data["notifications"]:
-                    if notification.get("id") == notification_id:
-                        notification["status"] = "reviewed"
-                        notification["reviewed_at"] = datetime.now().isoformat()
-                        
-                        self.notifications_log_file.write_text(
-                            json.dumps(data, ensure_ascii=False, indent=2)
-                        )
-                        return True
-            return False
-        except Exception as e:
-            logger.error(f"Failed to mark notification as reviewed: {type(e).__name__}")
+        notification = self._cache_by_id.get(notification_id)
+        if notification is None:
             return False
+        
+        notification["status"] = "reviewed"
+        notification["reviewed_at"] = datetime.now().isoformat()
+        self._pending_ids.discard(notification_id)
+        
+        # Статус меняется внутри файла, поэтому нужна полная перезапись
+        self._needs_rewrite = True
+        self._mark_dirty()
+        return True
 
 
 # Фабричная функция для удобного создания менеджера
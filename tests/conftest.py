@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Модули бота лежат в корне репозитория, а не в пакете
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,213 @@
+import asyncio
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.types import Chat, Message, Update
+
+from ask_module import AskModule, _ACK_TEXT, _SendLimiter
+
+OWNER_ID = 42
+USER = {"id": 1, "is_bot": False, "first_name": "Иван", "username": "ivan"}
+CHAT = {"id": 1, "type": "private"}
+
+
+class RecordingSession(BaseSession):
+    """Сессия без сети: запоминает запросы и отвечает заглушками"""
+
+    def __init__(self, fail=None, delay=0):
+        super().__init__()
+        self.requests = []
+        self.fail = fail
+        self.delay = delay
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests.append(method)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail and self.fail(method):
+            raise TelegramBadRequest(method=method, message="Bad Request: message is not modified")
+        if isinstance(method, (SendMessage, EditMessageText)):
+            return Message(
+                message_id=1,
+                date=datetime.now(),
+                chat=Chat(id=method.chat_id or CHAT["id"], type="private"),
+                text=method.text
+            )
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        raise NotImplementedError
+
+
+def make_update(update_id, **payload):
+    return Update.model_validate({"update_id": update_id, **payload}, context={})
+
+
+def message_update(update_id, text):
+    return make_update(update_id, message={
+        "message_id": update_id, "date": 0, "chat": CHAT, "from": USER, "text": text
+    })
+
+
+def callback_update(update_id, data):
+    return make_update(update_id, callback_query={
+        "id": str(update_id),
+        "from": USER,
+        "chat_instance": "1",
+        "data": data,
+        "message": {"message_id": 2, "date": 0, "chat": CHAT, "text": "confirm?"}
+    })
+
+
+def run_ask_flow(tmp_path, monkeypatch, fail=None):
+    monkeypatch.chdir(tmp_path)
+    session = RecordingSession(fail=fail)
+
+    async def scenario():
+        bot = Bot(token="42:TEST", session=session)
+        dp = Dispatcher()
+        module = AskModule(dp, bot, owner_id=str(OWNER_ID))
+        await dp.feed_update(bot, message_update(1, "/ask"))
+        await dp.feed_update(bot, message_update(2, "Как с вами связаться?"))
+        await dp.feed_update(bot, callback_update(3, "ask_confirm"))
+        await module.notifier.flush()
+        return module
+
+    module = asyncio.run(scenario())
+    owner_sends = [
+        r for r in session.requests if isinstance(r, SendMessage) and r.chat_id == OWNER_ID
+    ]
+    edits = [r.text for r in session.requests if isinstance(r, EditMessageText)]
+    return module, owner_sends, edits
+
+
+def test_confirm_sends_question_to_owner_and_logs_it(tmp_path, monkeypatch):
+    module, owner_sends, edits = run_ask_flow(tmp_path, monkeypatch)
+
+    assert len(owner_sends) == 1
+    assert "Как с вами связаться?" in owner_sends[0].text
+    assert edits == [_ACK_TEXT]
+    assert [n["message"] for n in module.notifier._cache["notifications"]] == ["Как с вами связаться?"]
+
+
+def test_failed_ack_edit_does_not_cancel_owner_send(tmp_path, monkeypatch):
+    def fail_ack(method):
+        return isinstance(method, EditMessageText) and method.text == _ACK_TEXT
+
+    module, owner_sends, edits = run_ask_flow(tmp_path, monkeypatch, fail=fail_ack)
+
+    assert len(owner_sends) == 1
+    assert edits == [_ACK_TEXT]
+    assert len(module.notifier._cache["notifications"]) == 1
+
+
+def test_send_limiter_releases_permit_on_cancel():
+    async def scenario():
+        limiter = _SendLimiter(max_at_once=2, max_per_second=20)
+
+        async def send():
+            async with limiter:
+                pass
+
+        await send()  # занимает ближайший слот, следующие будут ждать
+        for _ in range(2):
+            task = asyncio.create_task(send())
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        # После отмен внутрь должны одновременно попасть max_at_once отправок
+        entered = 0
+        release = asyncio.Event()
+
+        async def hold():
+            nonlocal entered
+            async with limiter:
+                entered += 1
+                await release.wait()
+
+        async def wait_entered():
+            while entered < 2:
+                await asyncio.sleep(0.01)
+
+        holders = [asyncio.create_task(hold()) for _ in range(2)]
+        try:
+            await asyncio.wait_for(wait_entered(), timeout=1)
+        finally:
+            release.set()
+            for holder in holders:
+                holder.cancel()
+            await asyncio.gather(*holders, return_exceptions=True)
+        return entered
+
+    assert asyncio.run(scenario()) == 2
+
+
+def run_quick_asks(tmp_path, monkeypatch, texts):
+    monkeypatch.chdir(tmp_path)
+    session = RecordingSession()
+
+    async def scenario():
+        bot = Bot(token="42:TEST", session=session)
+        dp = Dispatcher()
+        module = AskModule(dp, bot, owner_id=str(OWNER_ID))
+        for update_id, text in enumerate(texts, 1):
+            await dp.feed_update(bot, message_update(update_id, text))
+        await module.notifier.flush()
+
+    asyncio.run(scenario())
+    replies = [
+        r.text for r in session.requests if isinstance(r, SendMessage) and r.chat_id == CHAT["id"]
+    ]
+    owner_sends = [
+        r for r in session.requests if isinstance(r, SendMessage) and r.chat_id == OWNER_ID
+    ]
+    return replies, owner_sends
+
+
+def test_rejected_quick_ask_does_not_start_cooldown(tmp_path, monkeypatch):
+    replies, owner_sends = run_quick_asks(tmp_path, monkeypatch, ["вопрос:", "вопрос: real q"])
+
+    assert replies[0].startswith("Пожалуйста, напишите вопрос")
+    assert not any(r.startswith("⏳") for r in replies)
+    assert len(owner_sends) == 1
+
+
+def test_repeated_quick_ask_is_throttled(tmp_path, monkeypatch):
+    replies, owner_sends = run_quick_asks(tmp_path, monkeypatch, ["вопрос: один", "вопрос: два"])
+
+    assert replies[-1].startswith("⏳")
+    assert len(owner_sends) == 1
+    assert "один" in owner_sends[0].text
+
+
+def test_parallel_quick_asks_from_one_user_are_throttled(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    session = RecordingSession(delay=0.05)
+
+    async def scenario():
+        bot = Bot(token="42:TEST", session=session)
+        dp = Dispatcher()
+        module = AskModule(dp, bot, owner_id=str(OWNER_ID))
+        # Polling обрабатывает апдейты параллельными задачами
+        await asyncio.gather(*(
+            dp.feed_update(bot, message_update(i, f"вопрос: спам {i}")) for i in range(1, 11)
+        ))
+        await module.notifier.flush()
+
+    asyncio.run(scenario())
+    replies = [
+        r.text for r in session.requests if isinstance(r, SendMessage) and r.chat_id == CHAT["id"]
+    ]
+    owner_text = "".join(
+        r.text for r in session.requests if isinstance(r, SendMessage) and r.chat_id == OWNER_ID
+    )
+
+    assert sum(r.startswith("⏳") for r in replies) == 9
+    assert owner_text.count("спам") == 1
@@ -0,0 +1,144 @@
+import asyncio
+
+import orjson
+import pytest
+
+from request_module import NotificationManager, parse_chat_id
+
+
+def test_load_skips_corrupted_line(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    log_file = tmp_path / "notifications_log.jsonl"
+    records = [{"id": i, "status": "pending", "message": str(i)} for i in range(1, 8)]
+    lines = [orjson.dumps(r) for r in records]
+    # Оборванная запись, к которой приклеилась следующая
+    lines[4] = lines[4][:10] + lines[5]
+    del lines[5]
+    log_file.write_bytes(b"\n".join(lines) + b"\n")
+
+    manager = NotificationManager("42")
+
+    ids = [n["id"] for n in manager._cache["notifications"]]
+    assert ids == [1, 2, 3, 4, 7]
+    assert manager._next_id == 8
+
+
+def test_load_skips_records_without_id(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    log_file = tmp_path / "notifications_log.jsonl"
+    log_file.write_bytes(
+        b'{"notifications": []}\n123\n'
+        + orjson.dumps({"id": 1, "status": "pending"}) + b"\n"
+    )
+
+    manager = NotificationManager("42")
+
+    assert [n["id"] for n in manager._cache["notifications"]] == [1]
+    assert manager._next_id == 2
+
+def test_append_after_torn_line_starts_new_line(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    log_file = tmp_path / "notifications_log.jsonl"
+    log_file.write_bytes(orjson.dumps({"id": 1, "status": "pending"}) + b"\n" + b'{"id": 2, "sta')
+
+    async def scenario():
+        manager = NotificationManager("42")
+        await manager._log_notification("question", {"id": 1}, "user_question")
+        await manager.flush()
+
+    asyncio.run(scenario())
+
+    reloaded = NotificationManager("42")
+    assert [n["id"] for n in reloaded._cache["notifications"]] == [1, 2]
+
+
+def test_failed_write_keeps_unsaved_records(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def scenario():
+        manager = NotificationManager("42")
+        manager.write_batch_delay = 0
+
+        def broken_append(notifications):
+            raise OSError("disk full")
+
+        monkeypatch.setattr(manager, "_append_notifications", broken_append)
+        await manager._log_notification("question", {"id": 1}, "user_question")
+        await manager._write_queue.join()
+        assert [n["message"] for n in manager._unsaved] == ["question"]
+
+        # Диск снова доступен: flush() дописывает сохраненные в памяти записи
+        del manager._append_notifications
+        await manager.flush()
+        assert manager._unsaved == []
+
+    asyncio.run(scenario())
+
+    reloaded = NotificationManager("42")
+    assert [n["message"] for n in reloaded._cache["notifications"]] == ["question"]
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, **kwargs):
+        self.sent.append(kwargs)
+
+
+def test_owner_messages_are_sent_in_one_batch(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bot = FakeBot()
+
+    async def scenario():
+        manager = NotificationManager("42")
+        for i in range(3):
+            await manager.queue_owner_message(f"question {i}", bot)
+        await manager.flush()
+
+    asyncio.run(scenario())
+
+    assert len(bot.sent) == 1
+    assert bot.sent[0]["chat_id"] == 42
+    assert all(f"question {i}" in bot.sent[0]["text"] for i in range(3))
+
+
+def test_send_to_owner_reports_queued(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bot = FakeBot()
+
+    async def scenario():
+        manager = NotificationManager("42")
+        result = await manager.send_to_owner("question", {"id": 1}, bot)
+        await manager.flush()
+        return result
+
+    result = asyncio.run(scenario())
+
+    assert result["telegram_queued"] is True
+    assert result["logged"] is True
+    assert len(bot.sent) == 1
+
+
+def test_parse_chat_id():
+    assert parse_chat_id("123456789") == 123456789
+    assert parse_chat_id(" -1001234567890 ") == -1001234567890
+    assert parse_chat_id(None) is None
+    with pytest.raises(ValueError):
+        parse_chat_id("not-an-id")
+
+
+def test_non_persistent_manager_does_not_touch_the_log_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def scenario():
+        manager = NotificationManager("42", persist=False)
+        result = await manager._log_notification("question", {"id": 1}, "user_question")
+        await manager.flush()
+        return manager, result
+
+    manager, result = asyncio.run(scenario())
+
+    assert result["success"] is True
+    assert len(manager._cache["notifications"]) == 1
+    assert not (tmp_path / "notifications_log.jsonl").exists()
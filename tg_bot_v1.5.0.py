@@ -7,15 +7,25 @@ import time
 from pathlib import Path
 from datetime import datetime, timedelta
 from typing import Dict, List, Any
+from urllib.parse import urlparse
 
 # 1. Загрузка переменных окружения (если используете .env)
 from dotenv import load_dotenv
 load_dotenv()
 
 # 2. Импорты Telegram (aiogram)
-from aiogram import Bot, Dispatcher, types
+from aiogram import Bot, Dispatcher, Router, types
 from aiogram.filters import Command
+from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import Message
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+# uvloop ускоряет цикл событий, но есть не везде (например, нет под Windows)
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 # 3. Импорты GigaChat
 from gigachat import GigaChat
@@ -95,6 +105,13 @@ GIGACHAT_API_KEY = os.getenv("GIGACHAT_API_KEY")
 HISTORY_FILE = Path("user_histories.json")
 MAX_HISTORY_DAYS = 30  # Храним диалоги 30 дней
 KNOWLEDGE_FILE = Path("knowledge_base.json")
+# Redis для общего FSM-хранилища (нужен, если запущено несколько процессов бота)
+REDIS_URL = os.getenv("REDIS_URL")
+# Webhook вместо polling: включается, если задан публичный HTTPS-адрес
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # например https://example.com/webhook
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # необязательный секрет для проверки запросов
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
 user_injection_attempts: Dict[int, int] = {}
 
 
@@ -478,22 +495,35 @@ def format_personal_answer(query: str, kb_answer: str) -> str:
 # --- 5. ИНИЦИАЛИЗАЦИЯ TELEGRAM БОТА ---
 logging.basicConfig(level=logging.INFO)
 bot = Bot(token=TELEGRAM_BOT_TOKEN)
-dp = Dispatcher()
+if REDIS_URL:
+    from aiogram.fsm.storage.redis import RedisStorage
+    storage = RedisStorage.from_url(REDIS_URL)
+else:
+    storage = MemoryStorage()
+dp = Dispatcher(storage=storage)
+# Основные обработчики живут в своем роутере: обработчики самого Dispatcher
+# проверяются раньше вложенных роутеров, и общий @message() перехватил бы /ask
+router = Router(name="main")
 
 #+
 # Инициализация модуля вопросов владельцу
 if AskModule is not None:
     ask_module = AskModule(dp, bot, owner_id=os.getenv("OWNER_TELEGRAM_ID"))
+    # Перед остановкой дописываем на диск накопленный журнал вопросов
+    dp.shutdown.register(ask_module.notifier.flush)
     print("✅ Модуль вопросов владельцу загружен")
 else:
     print("⚠️ Модуль вопросов владельцу не загружен")
 
+# Подключаем после модуля вопросов, чтобы его обработчики проверялись первыми
+dp.include_router(router)
+
 
 #+
 
 
 # --- 6. ОБРАБОТЧИКИ КОМАНД ---
-@dp.message(Command("start", "help"))
+@router.message(Command("start", "help"))
 async def cmd_start(message: Message):
     welcome_text = (
         "🤖 Привет! Я ChemergesBot твой AI-ассистент на базе GigaChat.\n"
@@ -511,14 +541,14 @@ async def cmd_start(message: Message):
     await message.answer(welcome_text, parse_mode="HTML")
 #+
 
-@dp.message(Command("clear"))
+@router.message(Command("clear"))
 async def cmd_clear(message: Message):
     """Очищает историю диалога с пользователем."""
     clear_history(message.from_user.id)
     await message.answer("🗑️ История диалога очищена. Начнём с чистого листа!")
 
 # --- 7. ОБРАБОТЧИК ТЕКСТОВЫХ СООБЩЕНИЙ ---
-@dp.message()
+@router.message()
 async def handle_message(message: Message):
     user_id = message.from_user.id
     user_text = sanitize_user_input(message.text.strip())
@@ -568,7 +598,38 @@ async def handle_message(message: Message):
 # --- 8. ЗАПУСК БОТА ---
 async def main():
     print("🤖 AI Telegram бот запускается...")
+    # Если раньше бот работал через webhook, getUpdates без этого не заработает
+    await bot.delete_webhook()
     await dp.start_polling(bot)
 
+
+async def on_webhook_startup(bot: Bot):
+    """Регистрирует адрес webhook в Telegram при запуске сервера"""
+    await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+
+
+def run_webhook():
+    """Запускает бота в режиме webhook на встроенном aiohttp-сервере"""
+    print(f"🤖 AI Telegram бот запускается (webhook: {WEBHOOK_URL})...")
+    dp.startup.register(on_webhook_startup)
+    
+    app = web.Application()
+    # Апдейты обрабатываются в фоне: Telegram сразу получает ответ 200
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=WEBHOOK_SECRET
+    ).register(app, path=urlparse(WEBHOOK_URL).path or "/")
+    setup_application(app, dp, bot=bot)
+    
+    loop = uvloop.new_event_loop() if uvloop is not None else None
+    web.run_app(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT, loop=loop)
+
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if WEBHOOK_URL:
+        run_webhook()
+    elif uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
\ No newline at end of file